@@ -36,9 +36,18 @@ def is_retryable_exception(e):
     return False
 
 
+retry_sdk_call = retry(retry_on_exception=is_retryable_exception,
+                       wait_exponential_multiplier=1000,
+                       wait_exponential_max=10000,
+                       stop_max_attempt_number=5)
+
+
 class HuaweiCloudBaseAction(BaseAction, ABC):
     failed_resources = []
     result = {"succeeded_resources": [], "failed_resources": failed_resources}
+    # upper bound of concurrent api calls issued by `_parallel_map`,
+    # lower it on the action class when hitting the api rate limit.
+    max_workers = 10
 
     def get_tag_client(self):
         return local_session(self.manager.session_factory).client("tms")
@@ -47,13 +56,31 @@ class HuaweiCloudBaseAction(BaseAction, ABC):
         self.result.get("succeeded_resources").extend(resources)
         return self.result
 
-    @retry(retry_on_exception=is_retryable_exception,
-           wait_exponential_multiplier=1000,
-           wait_exponential_max=10000,
-           stop_max_attempt_number=5)
+    @retry_sdk_call
     def process_action(self, resource):
         self.perform_action(resource)
 
+    def _parallel_map(self, fn, items, workers=None):
+        """Apply `fn` to every item concurrently and return the results in order.
+
+        Each call gets the retry policy of `process_action`, so `fn` may be
+        run again for an item on retryable errors. All items are attempted
+        even if some of them fail, the first exception raised by `fn` is
+        re-raised once the workers are done.
+        """
+        fn = retry_sdk_call(fn)
+        results, errors = [], []
+        with self.executor_factory(max_workers=workers or self.max_workers) as w:
+            futures = [w.submit(fn, item) for item in items]
+            for f in futures:
+                if f.exception():
+                    errors.append(f.exception())
+                else:
+                    results.append(f.result())
+        if errors:
+            raise errors[0]
+        return results
+
     def process(self, resources):
         for resource in resources:
             self.process_action(resource)
@@ -14,6 +14,7 @@ from huaweicloudsdkconfig.v1 import ConfigClient, ShowTrackerConfigRequest
 from huaweicloudsdkconfig.v1.region.config_region import ConfigRegion
 from huaweicloudsdkcore.auth.credentials import BasicCredentials, GlobalCredentials
 from huaweicloudsdkcore.auth.provider import MetadataCredentialProvider
+from huaweicloudsdkcore.http.http_config import HttpConfig
 from huaweicloudsdkecs.v2 import EcsClient, ListServersDetailsRequest
 from huaweicloudsdkecs.v2.region.ecs_region import EcsRegion
 from huaweicloudsdkbms.v1 import BmsClient, ListBareMetalServerDetailsRequest
@@ -184,6 +185,20 @@ from huaweicloudsdkdns.v2 import (
 
 log = logging.getLogger("custodian.huaweicloud.client")
 
+# connection pool of clients whose actions issue concurrent api calls,
+# sized above the workers of `HuaweiCloudBaseAction.max_workers` (up to
+# 16 for vpc set-flow-log) so every worker keeps its own kept-alive
+# connection, the client is built once per action and shared by workers.
+POOL_CONNECTIONS = 20
+POOL_MAXSIZE = 50
+
+
+def get_pooled_http_config():
+    http_config = HttpConfig.get_default_config()
+    http_config.pool_connections = POOL_CONNECTIONS
+    http_config.pool_maxsize = POOL_MAXSIZE
+    return http_config
+
 
 class Session:
     """Session"""
@@ -239,6 +254,7 @@ class Session:
                 VpcClientV3.new_builder()
                 .with_credentials(credentials)
                 .with_region(VpcRegion.value_of(self.region))
+                .with_http_config(get_pooled_http_config())
                 .build()
             )
         elif service == "vpc_v2":
@@ -246,6 +262,7 @@ class Session:
                 VpcClientV2.new_builder()
                 .with_credentials(credentials)
                 .with_region(VpcRegion.value_of(self.region))
+                .with_http_config(get_pooled_http_config())
                 .build()
             )
         elif service == "ecs":
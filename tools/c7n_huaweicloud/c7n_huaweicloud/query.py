@@ -84,7 +84,8 @@ class ResourceQuery:
             elif pagination == "start_number":
                 resources = self._pagination_limit_start_number(m, enum_op, path, limit)
             elif pagination == "marker":
-                resources = self._pagination_limit_marker(m, enum_op, path)
+                marker_pagination = DefaultMarkerPagination(limit) if limit else None
+                resources = self._pagination_limit_marker(m, enum_op, path, marker_pagination)
             elif pagination == "maxitems-marker":
                 resources = self._pagination_maxitems_marker(m, enum_op, path)
             elif pagination is None:
@@ -2,10 +2,13 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import copy
+import functools
 import logging
 import json
 import netaddr
 import os
+import types
+from bisect import bisect_right
 
 from huaweicloudsdkcore.exceptions import exceptions
 from huaweicloudsdkvpc.v2 import (
@@ -37,6 +40,7 @@ from huaweicloudsdkvpc.v3 import (
     BatchCreateSecurityGroupRulesRequestBody,
     BatchCreateSecurityGroupRulesOption,
     ShowAddressGroupRequest,
+    SecurityGroupRule as SecurityGroupRuleModel,
     AllowedAddressPair as AllowedAddressPairV3,
     UpdateSubNetworkInterfaceOption,
     UpdateSubNetworkInterfaceRequest,
@@ -44,12 +48,12 @@ from huaweicloudsdkvpc.v3 import (
 )
 
 from c7n.exceptions import PolicyExecutionError, PolicyValidationError
-from c7n.filters import Filter, ValueFilter
-from c7n.utils import type_schema, local_session
-from c7n_huaweicloud.actions.base import HuaweiCloudBaseAction
+from c7n.filters import Filter
+from c7n.utils import chunks, type_schema, local_session
+from c7n_huaweicloud.actions.base import HuaweiCloudBaseAction, is_retryable_exception
 from c7n_huaweicloud.actions.smn import NotifyMessageAction
 from c7n_huaweicloud.provider import resources
-from c7n_huaweicloud.query import QueryResourceManager, TypeInfo
+from c7n_huaweicloud.query import DefaultMarkerPagination, QueryResourceManager, TypeInfo
 
 log = logging.getLogger("custodian.huaweicloud.resources.vpc")
 
@@ -440,7 +444,7 @@ class PortUpdateSecurityGroups(HuaweiCloudBaseAction):
 class SecurityGroup(QueryResourceManager):
     class resource_type(TypeInfo):
         service = 'vpc'
-        enum_spec = ('list_security_groups', 'security_groups', 'marker')
+        enum_spec = ('list_security_groups', 'security_groups', 'marker', 2000)
         id = 'id'
         tag_resource_type = 'security-groups'
 
@@ -499,11 +503,43 @@ class SecurityGroupUnAttached(Filter):
     """
 
     schema = type_schema('unattached')
+    # number of security groups per list_ports query and concurrent queries
+    chunk_size = 30
+    max_workers = 10
 
     def process(self, resources, event=None):
-        sg_ids = [r['id'] for r in resources]
-        sg_ids = list(set(sg_ids))
-        client = self.manager.get_resource_manager('vpc-port').get_client()
+        sg_ids = list({r['id'] for r in resources})
+        ports = self.get_ports(sg_ids)
+        attached = {sg_id for port in ports for sg_id in port['security_groups']}
+        unattached = [r for r in resources if r['id'] not in attached and r['name'] != 'default']
+
+        return unattached
+
+    def get_ports(self, sg_ids):
+        port_manager = self.manager.get_resource_manager('vpc-port')
+        key = {'service': port_manager.resource_type.service,
+               'resource': 'ports',
+               'security_groups': sorted(sg_ids)}
+        if port_manager._cache.load():
+            ports = port_manager._cache.get(key)
+            if ports is not None:
+                log.debug("[filters]-[unattached] using cached ports: %d", len(ports))
+                return ports
+        client = port_manager.get_client()
+        if len(sg_ids) <= self.chunk_size:
+            ports = self._list_ports(client, sg_ids)
+        else:
+            # split a large query into smaller ones issued concurrently
+            ports = {}
+            with self.executor_factory(max_workers=self.max_workers) as w:
+                for chunk_ports in w.map(functools.partial(self._list_ports, client),
+                                         chunks(sg_ids, self.chunk_size)):
+                    ports.update((p['id'], p) for p in chunk_ports)
+            ports = list(ports.values())
+        port_manager._cache.save(key, ports)
+        return ports
+
+    def _list_ports(self, client, sg_ids):
         try:
             request = ListPortsRequest(security_groups=sg_ids)
             response = client.list_ports(request)
@@ -514,15 +550,7 @@ class SecurityGroupUnAttached(Filter):
                       f"cause: query ports associated to the security groups [{sg_ids}] "
                       f"failed, error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
             raise ex
-        ports_object = response.ports
-        ports = [p.to_dict() for p in ports_object]
-        port_sgs = []
-        for port in ports:
-            port_sgs.extend(port['security_groups'])
-        port_sgs = list(set(port_sgs))
-        unattached = [r for r in resources if r['id'] not in port_sgs and r['name'] != 'default']
-
-        return unattached
+        return [{'id': p.id, 'security_groups': p.security_groups} for p in response.ports]
 
 
 @SecurityGroup.filter_registry.register('without_specific_tags')
@@ -579,7 +607,7 @@ class SecurityGroupWithoutSpecificTags(Filter):
 class SecurityGroupRule(QueryResourceManager):
     class resource_type(TypeInfo):
         service = 'vpc'
-        enum_spec = ('list_security_group_rules', 'security_group_rules', 'marker')
+        enum_spec = ('list_security_group_rules', 'security_group_rules', 'marker', 2000)
         id = 'id'
 
     def get_resources(self, resource_ids):
@@ -635,6 +663,29 @@ class SecurityGroupRule(QueryResourceManager):
         return resources
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_multiport(multiport):
+    """Parse the `multiport` of a rule, like '22,80-90', into its single ports
+    and the sorted starts and ends of its (merged) port ranges.
+    """
+    singles = set()
+    ranges = []
+    for port_item in multiport.split(','):
+        if '-' in port_item:
+            start, end = port_item.split('-')
+            ranges.append((int(start), int(end)))
+        else:
+            singles.add(int(port_item))
+    starts, ends = [], []
+    for start, end in sorted(ranges):
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return frozenset(singles), tuple(starts), tuple(ends)
+
+
 class SecurityGroupRuleFilter(Filter):
     """Filter for verifying security group ingress and egress rules
 
@@ -747,15 +798,17 @@ class SecurityGroupRuleFilter(Filter):
     port 22 from 0.0.0.0/0) still requires separate filters.
     """
 
-    perm_attrs = {
+    perm_attrs = frozenset({
         'RemoteIpPrefix', 'SGRuleIds', 'SecurityGroupIds', 'Descriptions',
         'Ethertypes', 'Action', 'Priorities', 'Protocols', 'SGReferenceIds',
-        'AGReferenceIds'}
-    filter_attrs = {
+        'AGReferenceIds'})
+    filter_attrs = frozenset({
         'AnyInPorts', 'AllInPorts', 'NotInPorts', 'AllPorts', 'SelfReference',
-        'DefaultSG'}
-    attrs = perm_attrs.union(filter_attrs)
-    attrs.add('match-operator')
+        'DefaultSG'})
+    attrs = perm_attrs | filter_attrs | frozenset({'match-operator'})
+    item_attrs = (
+        'Protocols', 'SGRuleIds', 'SecurityGroupIds', 'Descriptions', 'Ethertypes',
+        'Priorities', 'SGReferenceIds', 'AGReferenceIds', 'Action')
 
     def validate(self):
         delta = set(self.data.keys()).difference(self.attrs)
@@ -763,20 +816,24 @@ class SecurityGroupRuleFilter(Filter):
         if delta:
             raise PolicyValidationError("Unknown keys %s on %s" % (
                 ", ".join(delta), self.manager.data))
+        # `Action` is matched via process_items as a single value
+        if 'Action' in self.data and not isinstance(self.data['Action'], str):
+            raise PolicyValidationError("Action must be a string on %s" % (
+                self.manager.data))
         return self
 
     def process(self, resources, event=None):
-        self.vfilters = []
-        fattrs = list(sorted(self.perm_attrs.intersection(self.data.keys())))
-        for f in fattrs:
-            fv = self.data.get(f)
-            if isinstance(fv, dict):
-                fv['key'] = f
-            else:
-                fv = {f: fv}
-            vf = ValueFilter(fv, self.manager)
-            vf.annotate = False
-            self.vfilters.append(vf)
+        protocols = self.data.get('Protocols')
+        if protocols and -1 in protocols:
+            self.data['Protocols'] = [p if p != -1 else '-1' for p in protocols]
+        # item values are matched by membership, convert them once into sets.
+        self._item_sets = {}
+        for k in self.item_attrs:
+            items = self.data.get(k)
+            if isinstance(items, list):
+                self._item_sets[k] = frozenset(items)
+            elif isinstance(items, str):
+                self._item_sets[k] = frozenset((items,))
         self.default_sg = ''
         if self.data.get('DefaultSG', None) is not None:
             client = self.manager.get_client()
@@ -796,39 +853,35 @@ class SecurityGroupRuleFilter(Filter):
                           f"cause: query default security group failed, "
                           f"error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
                 raise ex
+        # the policy ports are fixed for the filter, expand them once per run
+        self._in_ports = {k: frozenset(self._extend_ports(self.data.get(k)))
+                          for k in ('AnyInPorts', 'AllInPorts', 'NotInPorts')}
+        self.checks = self._get_checks()
+        self._is_and = self.data.get('match-operator', 'and') == 'and'
+        self._matched_key = 'Matched' + self.direction.capitalize()
+        # the direction is fixed per filter, only check rules of that direction
+        resources = [r for r in resources if r.get('direction') == self.direction]
         return super(SecurityGroupRuleFilter, self).process(resources, event)
 
-    def process_direction(self, rule):
-        return self.direction == rule['direction']
-
     def process_ips(self, rule):
-        found = None
-        if 'RemoteIpPrefix' in self.data:
-            match_value = self.data['RemoteIpPrefix']
-            found = ('remote_ip_prefix' in rule and match_value == rule['remote_ip_prefix']) or \
-                    ('remote_ip_prefix' not in rule and str(match_value) == '-1')
-        return found
+        match_value = self.data.get('RemoteIpPrefix')
+        if match_value is None:
+            return None
+        if 'remote_ip_prefix' not in rule:
+            return str(match_value) == '-1'
+        return match_value == rule['remote_ip_prefix']
 
     def process_protocols(self, rule):
-        found = None
-        if 'Protocols' in self.data:
-            match_value = self.data['Protocols']
-            if -1 in match_value:
-                match_value.remove(-1)
-                match_value.append('-1')
-            protocol = rule['protocol'] if 'protocol' in rule else '-1'
-            found = protocol in match_value
-        return found
+        items = self._item_sets.get('Protocols')
+        if items is None:
+            return None
+        return rule.get('protocol', '-1') in items
 
     def process_items(self, rule, filter_key, rule_key):
-        found = None
-        if filter_key in self.data:
-            items = self.data[filter_key]
-            if isinstance(items, list):
-                found = rule_key in rule and rule[rule_key] in items
-            elif isinstance(items, str):
-                found = rule_key in rule and rule[rule_key] == items
-        return found
+        items = self._item_sets.get(filter_key)
+        if items is None:
+            return None
+        return rule.get(rule_key) in items
 
     def _extend_ports(self, req_port_list):
         if not req_port_list:
@@ -840,7 +893,7 @@ class SecurityGroupRuleFilter(Filter):
             elif isinstance(item, str):
                 port_range = item.split('-')
                 if len(port_range) == 1:
-                    int_port_list.append(port_range[0])
+                    int_port_list.append(int(port_range[0]))
                 elif len(port_range) == 2:
                     start = int(port_range[0])
                     end = int(port_range[1])
@@ -853,72 +906,37 @@ class SecurityGroupRuleFilter(Filter):
         return int_port_list
 
     def process_ports(self, rule):
-        all_ports = self.data['AllPorts'] if 'AllPorts' in self.data else False
         # rule matches when allows all ports(1-65535)
-        if all_ports is True:
+        if self.data.get('AllPorts') is True:
             if 'multiport' not in rule:
                 return True
             else:
                 multiport = self._extend_ports(rule.get('multiport').split(','))
                 return len(multiport) == 65535
 
-        any_in_ports = self.data['AnyInPorts'] if 'AnyInPorts' in self.data else []
-        all_in_ports = self.data['AllInPorts'] if 'AllInPorts' in self.data else []
-        not_in_ports = self.data['NotInPorts'] if 'NotInPorts' in self.data else []
-
-        any_in_ports = self._extend_ports(any_in_ports)
-        all_in_ports = self._extend_ports(all_in_ports)
-        not_in_ports = self._extend_ports(not_in_ports)
+        any_in_ports = self._in_ports['AnyInPorts']
+        all_in_ports = self._in_ports['AllInPorts']
+        not_in_ports = self._in_ports['NotInPorts']
 
         if not any_in_ports and not all_in_ports and not not_in_ports:
             return True
         multiport = rule.get('multiport', '-1')
         if multiport == '-1':
-            return (any_in_ports or all_in_ports) and not not_in_ports
-        rule_port_list = multiport.split(',')
-        single_rule_ports = []
-        range_rule_ports = []
-        for port_item in rule_port_list:
-            if '-' in port_item:
-                range_rule_ports.append(port_item)
-            else:
-                single_rule_ports.append(int(port_item))
+            return bool(any_in_ports or all_in_ports) and not not_in_ports
+        singles, starts, ends = _parse_multiport(multiport)
 
-        # rule matches when all ports of rule in `AllInPorts`
-        all_in_found = True
-        for port in all_in_ports:
-            if port in single_rule_ports:
-                all_in_found = True
-                continue
-            else:
-                all_in_found = any(port >= int(port_range.split('-')[0])
-                                   and port <= int(port_range.split('-')[1])
-                                   for port_range in range_rule_ports)
-            if not all_in_found:
-                break
+        def _in_rule(port):
+            if port in singles:
+                return True
+            i = bisect_right(starts, port) - 1
+            return i >= 0 and ends[i] >= port
 
+        # rule matches when all ports of rule in `AllInPorts`
+        all_in_found = all(_in_rule(port) for port in all_in_ports)
         # rule matches when any port of rule in `AnyInPorts`
-        any_in_found = True
-        for port in any_in_ports:
-            if port in single_rule_ports:
-                any_in_found = True
-            else:
-                any_in_found = any(port >= int(port_range.split('-')[0])
-                                   and port <= int(port_range.split('-')[1])
-                                   for port_range in range_rule_ports)
-            if any_in_found:
-                break
-
+        any_in_found = not any_in_ports or any(_in_rule(port) for port in any_in_ports)
         # rule matches when all ports of rule not in `NotInPorts`
-        not_in_found = True
-        for port in not_in_ports:
-            if port in single_rule_ports:
-                not_in_found = False
-                break
-            else:
-                not_in_found = all(port < int(port_range.split('-')[0])
-                                   or port > int(port_range.split('-')[1])
-                                   for port_range in range_rule_ports)
+        not_in_found = not any(_in_rule(port) for port in not_in_ports)
 
         return all_in_found and any_in_found and not_in_found
 
@@ -942,48 +960,52 @@ class SecurityGroupRuleFilter(Filter):
                 if self.data.get('DefaultSG') else (self.default_sg != rule_sg_id)
         return found
 
+    def _get_checks(self):
+        # cheap checks come first and the port ranges last, `__call__` stops at
+        # the first result that settles the match.
+        items = functools.partial
+        return [
+            self.process_ips,
+            items(self.process_items, filter_key='SGRuleIds', rule_key='id'),
+            items(self.process_items, filter_key='SecurityGroupIds',
+                  rule_key='security_group_id'),
+            items(self.process_items, filter_key='Descriptions', rule_key='description'),
+            items(self.process_items, filter_key='Ethertypes', rule_key='ethertype'),
+            items(self.process_items, filter_key='Priorities', rule_key='priority'),
+            items(self.process_items, filter_key='SGReferenceIds', rule_key='remote_group_id'),
+            items(self.process_items, filter_key='AGReferenceIds',
+                  rule_key='remote_address_group_id'),
+            items(self.process_items, filter_key='Action', rule_key='action'),
+            self.process_protocols,
+            self.process_self_reference,
+            self.process_default_sg,
+            self.process_ports,
+        ]
+
     def __call__(self, resource):
-        matched = []
-        match_op = self.data.get('match-operator', 'and') == 'and' and all or any
-        perm_matches = {}
-
-        perm_matches['direction'] = self.process_direction(resource)
-        perm_matches['ips'] = self.process_ips(resource)
-        perm_matches['sg_rule_ids'] = self.process_items(resource, 'SGRuleIds', 'id')
-        perm_matches['sg_ids'] = self.process_items(resource, 'SecurityGroupIds',
-                                                    'security_group_id')
-        perm_matches['descriptions'] = self.process_items(resource, 'Descriptions', 'description')
-        perm_matches['ethertypes'] = self.process_items(resource, 'Ethertypes', 'ethertype')
-        perm_matches['priorities'] = self.process_items(resource, 'Priorities', 'priority')
-        perm_matches['sg_reference_ids'] = self.process_items(resource, 'SGReferenceIds',
-                                                              'remote_group_id')
-        perm_matches['ag_reference_ids'] = self.process_items(resource, 'AGReferenceIds',
-                                                              'remote_address_group_id')
-        perm_matches['protocols'] = self.process_protocols(resource)
-        perm_matches['ports'] = self.process_ports(resource)
-        perm_matches['self_reference'] = self.process_self_reference(resource)
-        perm_matches['action'] = self.process_items(resource, 'Action', 'action')
-        perm_matches['default'] = self.process_default_sg(resource)
-
-        perm_match_values = list(filter(
-            lambda x: x is not None, perm_matches.values()))
+        is_and = self._is_and
         # account for one python behavior any([]) == False, all([]) == True
-        if match_op == all and not perm_match_values:
-            return False
-
-        match = match_op(perm_match_values)
-        if match:
-            matched.append(resource)
+        matched = False
+        for check in self.checks:
+            found = check(resource)
+            if found is None:
+                continue
+            if bool(found) is not is_and:
+                # a failed check with `and` or a passed one with `or` settles the match
+                matched = not is_and
+                break
+            matched = is_and
 
         if matched:
-            resource.setdefault('Matched%s' % self.direction.capitalize(), [])
+            resource.setdefault(self._matched_key, [])
             # If the same rule matches multiple filters, only add it to the match annotation
             # once. Note: Because we're looking for unique dicts and those aren't hashable,
             # we can't conveniently use set() to de-duplicate rules.
             return True
+        return False
 
 
-SGRuleSchema = {
+SGRuleSchema = types.MappingProxyType({
     'match-operator': {'type': 'string', 'enum': ['or', 'and']},
     'RemoteIpPrefix': {
         'oneOf': [
@@ -1035,29 +1057,32 @@ SGRuleSchema = {
     'AllPorts': {'type': 'boolean'},
     'SelfReference': {'type': 'boolean'},
     'DefaultSG': {'type': 'boolean'}
-}
+})
 
 
-@SecurityGroupRule.filter_registry.register("ingress")
-class SecurityGroupRuleIngress(SecurityGroupRuleFilter):
-    direction = "ingress"
-    schema = {
+def _build_schema(direction):
+    """Build the schema of an ingress/egress filter, each filter gets its own
+    copy of the shared rule properties.
+    """
+    properties = {'type': {'enum': [direction]}}
+    properties.update(copy.deepcopy(dict(SGRuleSchema)))
+    return {
         'type': 'object',
         'additionalProperties': False,
-        'properties': {'type': {'enum': ['ingress']}},
+        'properties': properties,
         'required': ['type']}
-    schema['properties'].update(SGRuleSchema)
+
+
+@SecurityGroupRule.filter_registry.register("ingress")
+class SecurityGroupRuleIngress(SecurityGroupRuleFilter):
+    direction = "ingress"
+    schema = _build_schema(direction)
 
 
 @SecurityGroupRule.filter_registry.register("egress")
 class SecurityGroupRuleEgress(SecurityGroupRuleFilter):
     direction = "egress"
-    schema = {
-        'type': 'object',
-        'additionalProperties': False,
-        'properties': {'type': {'enum': ['egress']}},
-        'required': ['type']}
-    schema['properties'].update(SGRuleSchema)
+    schema = _build_schema(direction)
 
 
 @SecurityGroupRule.action_registry.register("delete")
@@ -1127,16 +1152,21 @@ class RemoveSecurityGroupRules(HuaweiCloudBaseAction):
         ingress={'type': 'string', 'enum': ['matched', 'all']},
         egress={'type': 'string', 'enum': ['matched', 'all']})
 
+    # page size of the rules queried in the security groups of the matched rules
+    list_limit = 2000
+
     def process(self, resources):
         i_mode = self.data.get('ingress', 'matched')
         e_mode = self.data.get('egress', 'matched')
 
         client = self.manager.get_client()
-        sg_ids = [r['security_group_id'] for r in resources]
-        sg_ids = list(set(sg_ids))
+        sg_ids = list({r['security_group_id'] for r in resources})
         ret_rules = []
+        direction_rules = {'ingress': [], 'egress': []}
+        for r in resources:
+            direction_rules[r['direction']].append(r)
         for direction, mode in [('ingress', i_mode), ('egress', e_mode)]:
-            rules = [r for r in resources if direction == r['direction']]
+            rules = direction_rules[direction]
             # remove matched rules
             if mode == 'matched':
                 self.perform_action(rules, 'remove-rules')
@@ -1144,9 +1174,7 @@ class RemoveSecurityGroupRules(HuaweiCloudBaseAction):
             # remove all rules in the security group of the matched rules
             elif mode == 'all':
                 try:
-                    request = ListSecurityGroupRulesRequest(security_group_id=sg_ids,
-                                                            direction=direction)
-                    response = client.list_security_group_rules(request)
+                    all_rules = self._list_rules(client, sg_ids, direction)
                     log.info(f"[actions]-[remove-rules]-The resource:[vpc-security-group-rule] "
                              f"query {mode} rules in security groups "
                              f"of the matched rules succeed.")
@@ -1158,52 +1186,111 @@ class RemoveSecurityGroupRules(HuaweiCloudBaseAction):
                               f"error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
                     raise ex
 
-                all_rules_object = response.security_group_rules
-                all_rules = [r.to_dict() for r in all_rules_object]
                 self.perform_action(all_rules, 'remove-rules')
                 ret_rules.extend(all_rules)
             # remove rules with a list of rule filter conditions
             elif isinstance(mode, list):
-                for f in mode:
-                    try:
-                        request = ListSecurityGroupRulesRequest(security_group_id=sg_ids,
-                                                                direction=direction)
-                        f = dict(f)
-                        for key, value in f.items():
-                            setattr(request, key, value)
-                        response = client.list_security_group_rules(request)
-                        to_delete_rules_object = response.security_group_rules
-                        to_delete_rules = [r.to_dict() for r in to_delete_rules_object]
-                        log.info("[actions]-[set-rules]-The resource:[vpc-security-group-rule] "
-                                 "query rules in security groups of the matched rules succeed.")
-                    except exceptions.ServiceResponseException as ex:
-                        log.error("[actions]-[set-rules]-The resource:[vpc-security-group-rule] "
-                                  "remove specific rules failed, cause: query rules failed, "
-                                  f"error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
-                        raise ex
-                    self.perform_action(to_delete_rules, 'set-rules')
-                    ret_rules.extend(to_delete_rules)
+                try:
+                    all_rules = self._list_rules(client, sg_ids, direction)
+                    log.info("[actions]-[set-rules]-The resource:[vpc-security-group-rule] "
+                             "query rules in security groups of the matched rules succeed.")
+                except exceptions.ServiceResponseException as ex:
+                    log.error("[actions]-[set-rules]-The resource:[vpc-security-group-rule] "
+                              "remove specific rules failed, cause: query rules failed, "
+                              f"error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
+                    raise ex
+                # match the rule filter conditions in memory rather than
+                # querying the rules once per condition
+                to_delete_rules = [r for r in all_rules
+                                   if any(self._match_rule(r, f) for f in mode)]
+                self.perform_action(to_delete_rules, 'set-rules')
+                ret_rules.extend(to_delete_rules)
 
         return self.process_remove_result(ret_rules)
 
+    def _list_rules(self, client, sg_ids, direction):
+        # page through the rules, the groups may hold more rules than one page
+        pagination = DefaultMarkerPagination(self.list_limit)
+        request = ListSecurityGroupRulesRequest(security_group_id=sg_ids, direction=direction,
+                                                **pagination.get_first_page_params())
+        rules = []
+        while True:
+            response = client.list_security_group_rules(request)
+            rules.extend(r.to_dict() for r in response.security_group_rules)
+            next_page_params = pagination.get_next_page_params(response)
+            if not next_page_params:
+                return rules
+            request.marker = next_page_params['marker']
+
+    @classmethod
+    def _match_rule(cls, rule, conditions):
+        # conditions use the query parameters of `list_security_group_rules`,
+        # where a list value matches any of its items. Like the api, values are
+        # compared as the type of the rule field and `ethertype` ignores case.
+        for key, value in conditions.items():
+            values = value if isinstance(value, list) else [value]
+            expected = {cls._normalize_rule_value(key, v) for v in values}
+            if cls._normalize_rule_value(key, rule.get(key)) not in expected:
+                return False
+        return True
+
+    @staticmethod
+    def _normalize_rule_value(key, value):
+        rule_type = SecurityGroupRuleModel.openapi_types.get(key)
+        if value is None or rule_type is None:
+            return value
+        try:
+            if rule_type == 'int':
+                value = int(value)
+            elif rule_type == 'bool' and not isinstance(value, bool):
+                value = str(value).lower() == 'true'
+            elif rule_type == 'str':
+                value = str(value)
+        except (TypeError, ValueError):
+            return value
+        if key == 'ethertype':
+            value = value.lower()
+        return value
+
     def process_remove_result(self, resources):
         remove_result = {"remove_succeeded_rules": [], "remove_failed_rules": self.failed_resources}
         remove_result.get("remove_succeeded_rules").extend(resources)
+        log.debug("[actions]-[remove-rules]-The resource:[vpc-security-group-rule] "
+                  "remove result: %s", remove_result)
         return remove_result
 
     def perform_action(self, rules, action=None):
+        self._batch_delete_rules(rules, action)
+
+    def _batch_delete_rules(self, rules, action=None):
+        # VPC offers no batch delete api for security group rules, so rules are
+        # grouped by security group like the batch create in `set-rules`, groups
+        # are handled concurrently and rules of one group are deleted in turn.
         client = self.manager.get_client()
+        sg_rules = {}
         for r in rules:
-            try:
-                request = DeleteSecurityGroupRuleRequest(security_group_rule_id=r["id"])
-                client.delete_security_group_rule(request)
-                log.info(f"[actions]-[{action}]-The resource:[vpc-security-group-rule] "
-                         f"with id: [{r['id']}] delete security group rule succeed.")
-            except exceptions.ServiceResponseException as ex:
-                log.error(f"[actions]-[{action}]-The resource:[vpc-security-group-rule] "
-                          f"with id: [{r['id']}] delete security group rule failed, "
-                          f"cause: error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
-                raise ex
+            sg_rules.setdefault(r['security_group_id'], []).append(r)
+
+        def _delete(sg_id):
+            for r in sg_rules[sg_id]:
+                try:
+                    request = DeleteSecurityGroupRuleRequest(security_group_rule_id=r["id"])
+                    client.delete_security_group_rule(request)
+                    log.info(f"[actions]-[{action}]-The resource:[vpc-security-group-rule] "
+                             f"with id: [{r['id']}] delete security group rule succeed.")
+                except exceptions.ServiceResponseException as ex:
+                    if ex.status_code == 404:
+                        # deleted by an earlier attempt of this group
+                        log.info(f"[actions]-[{action}]-The resource:[vpc-security-group-rule] "
+                                 f"with id: [{r['id']}] security group rule has been deleted, "
+                                 f"skip.")
+                        continue
+                    log.error(f"[actions]-[{action}]-The resource:[vpc-security-group-rule] "
+                              f"with id: [{r['id']}] delete security group rule failed, "
+                              f"cause: error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
+                    raise ex
+
+        self._parallel_map(_delete, list(sg_rules))
 
 
 @SecurityGroupRule.action_registry.register('set-rules')
@@ -1270,8 +1357,7 @@ class SetSecurityGroupRules(HuaweiCloudBaseAction):
         i_rules = self.data.get('add-ingress', ())
         e_rules = self.data.get('add-egress', ())
 
-        sg_ids = [r['security_group_id'] for r in resources]
-        sg_ids = list(set(sg_ids))
+        sg_ids = list({r['security_group_id'] for r in resources})
         client = self.manager.get_client()
         ret_rules = []
         # add rules
@@ -1332,6 +1418,8 @@ class SetSecurityGroupRules(HuaweiCloudBaseAction):
         multi_result = {"add_succeeded_rules": [], "add_failed_rules": []}
         multi_result.get("add_succeeded_rules").extend(add_rules)
         multi_result.update(remove_result)
+        log.debug("[actions]-[set-rules]-The resource:[vpc-security-group-rule] "
+                  "set result: %s", multi_result)
         return multi_result
 
     def perform_action(self, resource):
@@ -1848,6 +1936,14 @@ class SecurityGroupRuleDenyRiskPorts(HuaweiCloudBaseAction):
         return None
 
 
+@functools.lru_cache(maxsize=32)
+def _flow_log_template(fl_items):
+    """Build the `CreateFlowLogReq` template of a `create-attrs` item,
+    shared between runs so it must only be copied, never mutated.
+    """
+    return CreateFlowLogReq(**dict(fl_items))
+
+
 @resources.register('vpc-flow-log')
 class FlowLog(QueryResourceManager):
     class resource_type(TypeInfo):
@@ -1901,40 +1997,58 @@ class SetFlowLog(HuaweiCloudBaseAction):
         **{'action': {'enum': ['enable', 'disable', 'create', 'delete']},
            'create-attrs': {'type': 'array', 'items': {'type': 'object'}}})
 
+    # flow log calls are independent and io bound, each one owns its request.
+    max_workers = 16
+
+    def validate(self):
+        fl_attrs = set(CreateFlowLogReq.openapi_types)
+        for fl in self.data.get('create-attrs', ()):
+            delta = set(fl).difference(fl_attrs)
+            if delta:
+                raise PolicyValidationError("Unknown keys %s in create-attrs on %s" % (
+                    ", ".join(sorted(delta)), self.manager.data))
+        return self
+
     def process(self, resources):
         action = self.data['action']
         client = self.manager.get_client()
         ret_fls = []
         if action in ['enable', 'disable']:
             admin_state = True if action == 'enable' else False
-            for fl in resources:
+
+            def _update(fl):
                 try:
                     request = UpdateFlowLogRequest(flowlog_id=fl['id'])
                     fl_body = UpdateFlowLogReq(admin_state=admin_state)
                     request.body = UpdateFlowLogReqBody(flow_log=fl_body)
                     response = client.update_flow_log(request)
-                    resp_fl = response.flow_log
-                    ret_fls.append(resp_fl.to_dict())
                     log.info(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
                              f"{action} flow log [{fl['id']}] succeed.")
                 except exceptions.ServiceResponseException as ex:
-                    log.error(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
-                              f"{action} flow log [{fl['id']}] failed, "
-                              f"cause: error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
+                    log.error("[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
+                              "%s flow log [%s] failed, cause: request_id[%s], "
+                              "error_code[%s], error_msg[%s].", action, fl['id'],
+                              ex.request_id, ex.error_code, ex.error_msg)
                     raise ex
+                return response.flow_log.to_dict()
+
+            ret_fls = self._parallel_map(_update, resources)
         elif action == 'delete':
-            for fl in resources:
+            def _delete(fl):
                 try:
                     request = DeleteFlowLogRequest(flowlog_id=fl['id'])
-                    response = client.delete_flow_log(request)
-                    ret_fls.append(fl)
+                    client.delete_flow_log(request)
                     log.info(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
                              f"{action} flow log [{fl['id']}] succeed.")
                 except exceptions.ServiceResponseException as ex:
-                    log.error(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
-                              f"{action} flow log [{fl['id']}] failed, "
-                              f"cause: error_code[{ex.error_code}], error_msg[{ex.error_msg}].")
+                    log.error("[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
+                              "%s flow log [%s] failed, cause: request_id[%s], "
+                              "error_code[%s], error_msg[%s].", action, fl['id'],
+                              ex.request_id, ex.error_code, ex.error_msg)
                     raise ex
+                return fl
+
+            ret_fls = self._parallel_map(_delete, resources)
         elif action == 'create':
             req_fls = self.data.get('create-attrs', ())
             resource_ids = [f['resource_id'] for f in resources]
@@ -1942,36 +2056,70 @@ class SetFlowLog(HuaweiCloudBaseAction):
             if not resource_ids:
                 return self.process_fl_result(ret_fls, action)
             resource_type = resources[0]['resource_type']
-            for r in resource_ids:
-                for fl in req_fls:
-                    try:
-                        request = CreateFlowLogRequest()
-                        fl_body = CreateFlowLogReq(resource_type=resource_type, resource_id=r)
-                        fl = dict(fl)
-                        for key, value in fl.items():
-                            setattr(fl_body, key, value)
-                        request.body = CreateFlowLogReqBody(flow_log=fl_body)
-                        response = client.create_flow_log(request)
-                        resp_fl = response.flow_log
-                        ret_fls.append(resp_fl.to_dict())
-                        log.info(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
-                                 f"{action} flow log of resource[{r}] succeed.")
-                    except exceptions.ServiceResponseException as ex:
-                        log.error(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
-                                  f"{action} flow log of resource[{r}] failed, "
-                                  f"cause: error_code[{ex.error_code}], "
-                                  f"error_msg[{ex.error_msg}].")
+            templates = [self.get_fl_template(resource_type, fl) for fl in req_fls]
+            bodies = [self.build_fl_body(t, r)
+                      for r in resource_ids for t in templates]
+
+            def _create(body):
+                r = body.flow_log.resource_id
+                try:
+                    response = client.create_flow_log(CreateFlowLogRequest(body=body))
+                    log.info(f"[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
+                             f"{action} flow log of resource[{r}] succeed.")
+                except exceptions.ServiceResponseException as ex:
+                    log.error("[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
+                              "%s flow log of resource[%s] failed, cause: request_id[%s], "
+                              "error_code[%s], error_msg[%s].", action, r,
+                              ex.request_id, ex.error_code, ex.error_msg)
+                    if is_retryable_exception(ex):
                         raise ex
+                    return None
+                return response.flow_log.to_dict()
+
+            # a failed create only fails its own resource, not the others
+            for body, fl in zip(bodies, self._parallel_map(_create, bodies)):
+                if fl is None:
+                    self.failed_resources.append({
+                        'resource_id': body.flow_log.resource_id,
+                        'resource_type': resource_type})
+                else:
+                    ret_fls.append(fl)
 
         return self.process_fl_result(ret_fls, action)
 
+    @staticmethod
+    def get_fl_template(resource_type, fl):
+        # `create-attrs` override the resource type, the resource id is always
+        # the one of the matched flow log.
+        fl = {'resource_type': resource_type, **fl}
+        fl.pop('resource_id', None)
+        fl_items = tuple(sorted(fl.items()))
+        try:
+            hash(fl_items)
+        except TypeError:
+            # unhashable attribute values can't be cached, build it as is
+            return CreateFlowLogReq(**fl)
+        return _flow_log_template(fl_items)
+
+    @staticmethod
+    def build_fl_body(template, resource_id):
+        """Build the request body creating a flow log of the resource
+        from a `CreateFlowLogReq` template, only `resource_id` differs.
+        """
+        fl_body = copy.copy(template)
+        fl_body.resource_id = resource_id
+        return CreateFlowLogReqBody(flow_log=fl_body)
+
     def perform_action(self, resource):
         return None
 
     def process_fl_result(self, resources, action):
-        action_result = {"action": action}
-        self.result.get("succeeded_resources").extend(resources)
-        self.result.update(action_result)
+        # the result is shared by all actions, always record this run's action
+        self.result["action"] = action
+        if resources:
+            self.result["succeeded_resources"].extend(resources)
+        log.debug("[actions]-[set-flow-log]-The resource:[vpc-flow-log] "
+                  "action=%s succeeded=%d", action, len(resources))
         return self.result
 
 
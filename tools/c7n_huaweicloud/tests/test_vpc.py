@@ -1,6 +1,11 @@
 # Copyright The Cloud Custodian Authors.
 # SPDX-License-Identifier: Apache-2.0
+import json
+from unittest import mock
+
+from c7n.exceptions import PolicyValidationError
 from huaweicloud_common import BaseTest
+from huaweicloudsdkcore.exceptions import exceptions
 
 
 class SecurityGroupTest(BaseTest):
@@ -27,6 +32,28 @@ class SecurityGroupTest(BaseTest):
         self.assertEqual(len(resources), 1)
         self.assertEqual(resources[0]['name'], 'sg-not-attached')
 
+    def test_security_group_unattached_filter_chunked(self):
+        from c7n_huaweicloud.resources.vpc import Port
+        p = self.load_policy({
+             'name': 'security-group-unattached-chunked',
+             'resource': 'huaweicloud.vpc-security-group',
+             'filters': ['unattached']})
+        f = p.resource_manager.filters[0]
+        f.chunk_size = 2
+        shared_port = {'id': 'p1', 'security_groups': ['sg-1', 'sg-3']}
+
+        def list_ports(client, sg_ids):
+            return [shared_port] if {'sg-1', 'sg-3'} & set(sg_ids) else []
+
+        resources = [{'id': 'sg-%d' % i, 'name': 'sg-%d' % i} for i in range(1, 6)]
+        with mock.patch.object(Port, 'get_client'), \
+                mock.patch.object(f, '_list_ports', side_effect=list_ports) as m:
+            ports = f.get_ports(sorted(r['id'] for r in resources))
+            self.assertEqual(m.call_count, 3)
+            self.assertEqual(ports, [shared_port])
+            unattached = f.process(resources)
+        self.assertEqual([r['id'] for r in unattached], ['sg-2', 'sg-4', 'sg-5'])
+
     def test_security_group_delete_action(self):
         factory = self.replay_flight_data('vpc_security_group_delete')
         p = self.load_policy({
@@ -81,6 +108,108 @@ class SecurityGroupTest(BaseTest):
         self.assertEqual(resources[0]['remote_ip_prefix'], '192.168.21.0/24')
         self.assertIn('8080', resources[0]['multiport'])
 
+    def test_security_group_rule_filter_multiport(self):
+        p = self.load_policy({
+             'name': 'security-group-rule-ports',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'AllInPorts': ['22', 70, '80-82']}]})
+        f = p.resource_manager.filters[0]
+        f.process([])
+        self.assertTrue(f.process_ports({'multiport': '22,1-100,50-60'}))
+        self.assertTrue(f.process_ports({'multiport': '10-30,60-90'}))
+        self.assertFalse(f.process_ports({'multiport': '22,50-60,80-90'}))
+
+        p = self.load_policy({
+             'name': 'security-group-rule-not-in-ports',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'NotInPorts': [22, 8080]}]})
+        f = p.resource_manager.filters[0]
+        f.process([])
+        self.assertTrue(f.process_ports({'multiport': '80,443,3000-3999'}))
+        self.assertFalse(f.process_ports({'multiport': '22,443'}))
+        self.assertFalse(f.process_ports({'multiport': '443,8000-8999'}))
+
+    def test_security_group_rule_filter_ports_expanded_once(self):
+        p = self.load_policy({
+             'name': 'security-group-rule-any-in-ports',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'AnyInPorts': ['1-65535']}]})
+        f = p.resource_manager.filters[0]
+        rules = [{'id': 'r%s' % i, 'direction': 'ingress', 'multiport': str(i + 1)}
+                 for i in range(5)]
+        with mock.patch.object(f, '_extend_ports', wraps=f._extend_ports) as m:
+            self.assertEqual(len(f.process(rules)), 5)
+        self.assertEqual(m.call_count, 3)
+
+    def test_security_group_rule_filter_and(self):
+        rules = [
+            {'id': 'r1', 'direction': 'ingress', 'protocol': 'tcp',
+             'remote_ip_prefix': '0.0.0.0/0', 'multiport': '22'},
+            {'id': 'r2', 'direction': 'ingress', 'protocol': 'udp',
+             'remote_ip_prefix': '0.0.0.0/0', 'multiport': '53'},
+            {'id': 'r3', 'direction': 'egress', 'protocol': 'tcp',
+             'remote_ip_prefix': '0.0.0.0/0', 'multiport': '22'},
+        ]
+        p = self.load_policy({
+             'name': 'security-group-rule-and',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'RemoteIpPrefix': '0.0.0.0/0',
+                          'Protocols': ['tcp']}]})
+        f = p.resource_manager.filters[0]
+        self.assertEqual([r['id'] for r in f.process(rules)], ['r1'])
+        self.assertIn('MatchedIngress', rules[0])
+
+    def test_security_group_rule_filter_or(self):
+        rules = [
+            {'id': 'r1', 'direction': 'ingress', 'protocol': 'udp',
+             'remote_ip_prefix': '0.0.0.0/0', 'multiport': '53'},
+            {'id': 'r2', 'direction': 'ingress', 'protocol': 'tcp',
+             'remote_ip_prefix': '10.0.0.0/8', 'multiport': '22'},
+            {'id': 'r3', 'direction': 'ingress', 'protocol': 'tcp',
+             'remote_ip_prefix': '0.0.0.0/0', 'multiport': '3000-4000'},
+            {'id': 'r4', 'direction': 'ingress', 'protocol': 'tcp',
+             'remote_ip_prefix': '0.0.0.0/0', 'multiport': '22'},
+        ]
+        p = self.load_policy({
+             'name': 'security-group-rule-or',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'match-operator': 'or',
+                          'RemoteIpPrefix': '10.0.0.0/8', 'Protocols': ['udp'],
+                          'AllInPorts': [3389]}]})
+        f = p.resource_manager.filters[0]
+        with mock.patch.object(f, 'process_ports', wraps=f.process_ports) as m:
+            self.assertEqual([r['id'] for r in f.process(rules)], ['r1', 'r2', 'r3'])
+        # the port check runs last, rules matched by a cheaper check skip it
+        self.assertEqual([c.args[0]['id'] for c in m.call_args_list], ['r3', 'r4'])
+
+    def test_security_group_rule_filter_all_protocols(self):
+        p = self.load_policy({
+             'name': 'security-group-rule-all-protocols',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'Protocols': [-1, 'icmp']}]})
+        f = p.resource_manager.filters[0]
+        rules = [{'id': 'r1', 'direction': 'ingress'},
+                 {'id': 'r2', 'direction': 'ingress', 'protocol': 'tcp'}]
+        self.assertEqual([r['id'] for r in f.process(rules)], ['r1'])
+        self.assertEqual([r['id'] for r in f.process(rules)], ['r1'])
+        self.assertEqual(f.data['Protocols'], ['-1', 'icmp'])
+
+    def test_security_group_rule_filter_reference_ids(self):
+        sg_ids = ['sg-%d' % i for i in range(1000)]
+        p = self.load_policy({
+             'name': 'security-group-rule-reference-ids',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'filters': [{'type': 'ingress', 'SecurityGroupIds': sg_ids,
+                          'SGReferenceIds': ['sg-ref']}]})
+        f = p.resource_manager.filters[0]
+        rules = [{'id': 'r1', 'direction': 'ingress', 'security_group_id': 'sg-999',
+                  'remote_group_id': 'sg-ref'},
+                 {'id': 'r2', 'direction': 'ingress', 'security_group_id': 'sg-1000',
+                  'remote_group_id': 'sg-ref'},
+                 {'id': 'r3', 'direction': 'ingress', 'security_group_id': 'sg-1'}]
+        self.assertEqual([r['id'] for r in f.process(rules)], ['r1'])
+        self.assertIsInstance(f._item_sets['SecurityGroupIds'], frozenset)
+
     def test_security_group_remove_rules_action(self):
         factory = self.replay_flight_data('vpc_security_group_remove_rules')
         p = self.load_policy({
@@ -97,6 +226,50 @@ class SecurityGroupTest(BaseTest):
         self.assertEqual(resources[0]['remote_ip_prefix'], '192.168.21.0/24')
         self.assertIn('8080', resources[0]['multiport'])
 
+    def test_security_group_remove_rules_match_rule(self):
+        from c7n_huaweicloud.resources.vpc import RemoveSecurityGroupRules
+        match = RemoveSecurityGroupRules._match_rule
+        rule = {'ethertype': 'IPv4', 'protocol': 'tcp', 'priority': 1,
+                'remote_ip_prefix': '0.0.0.0/0', 'action': 'allow'}
+        # ethertype is matched regardless of case
+        self.assertTrue(match(rule, {'ethertype': 'ipv4', 'remote_ip_prefix': '0.0.0.0/0'}))
+        self.assertTrue(match(rule, {'ethertype': ['ipv6', 'IPV4']}))
+        self.assertFalse(match(rule, {'ethertype': 'ipv6'}))
+        # values are coerced to the type of the rule field
+        self.assertTrue(match(rule, {'priority': '1'}))
+        self.assertTrue(match(rule, {'priority': ['2', 1]}))
+        self.assertFalse(match(rule, {'priority': 2}))
+        # list values match any of their items
+        self.assertTrue(match(rule, {'protocol': ['udp', 'tcp'], 'action': 'allow'}))
+        self.assertFalse(match(rule, {'protocol': ['udp', 'icmp']}))
+        self.assertFalse(match(rule, {'remote_ip_prefix': '::/0', 'action': 'allow'}))
+
+    def test_security_group_remove_rules_list_rules_pages(self):
+        p = self.load_policy({
+             'name': 'security-group-remove-rules',
+             'resource': 'huaweicloud.vpc-security-group-rule',
+             'actions': [{'type': 'remove-rules', 'ingress': 'all'}]})
+        action = p.resource_manager.actions[0]
+        action.list_limit = 2
+        pages = {None: (['r1', 'r2'], 'r2'), 'r2': (['r3'], None)}
+        markers = []
+
+        def list_security_group_rules(request):
+            markers.append(request.marker)
+            ids, next_marker = pages[request.marker]
+            page_info = {'current_count': len(ids)}
+            if next_marker:
+                page_info['next_marker'] = next_marker
+            rules = [mock.Mock(**{'to_dict.return_value': {'id': i}}) for i in ids]
+            response = mock.Mock(security_group_rules=rules)
+            response.__str__ = lambda self: json.dumps({'page_info': page_info})
+            return response
+
+        client = mock.Mock(list_security_group_rules=list_security_group_rules)
+        rules = action._list_rules(client, ['sg-1'], 'ingress')
+        self.assertEqual([r['id'] for r in rules], ['r1', 'r2', 'r3'])
+        self.assertEqual(markers, [None, 'r2'])
+
     def test_security_group_set_rules_action(self):
         factory = self.replay_flight_data('vpc_security_group_set_rules')
         p = self.load_policy({
@@ -114,7 +287,20 @@ class SecurityGroupTest(BaseTest):
                                           'multiport': '22,3389',
                                           'remote_ip_prefix': '192.168.33.0/24'}]}]},
             session_factory=factory)
-        resources = p.run()
+        from c7n_huaweicloud.resources.vpc import RemoveSecurityGroupRules
+        deleted = []
+        batch_delete = RemoveSecurityGroupRules._batch_delete_rules
+
+        def _batch_delete_rules(action, rules, *args):
+            deleted.extend(r['id'] for r in rules)
+            return batch_delete(action, rules, *args)
+
+        with mock.patch.object(
+                RemoveSecurityGroupRules, '_batch_delete_rules', _batch_delete_rules):
+            resources = p.run()
+        # the queried ingress rule outside of 192.168.22.0/24 is kept
+        self.assertIn('53c56e8d-00d2-4cb3-a661-c02770476c7a', deleted)
+        self.assertNotIn('9a1f4c2e-6b3d-4e8a-b7c5-2d0e1f3a4b5c', deleted)
         self.assertEqual(len(resources), 1)
         self.assertEqual(resources[0]['direction'], 'egress')
         self.assertEqual(resources[0]['protocol'], 'tcp')
@@ -138,6 +324,138 @@ class FlowLogTest(BaseTest):
         self.assertEqual(resources[0]['resource_type'], 'vpc')
         self.assertEqual(resources[0]['status'], 'DOWN')
 
+    def test_flow_log_create_flow_log_action(self):
+        p = self.load_policy({
+             'name': 'create-flow-log',
+             'resource': 'huaweicloud.vpc-flow-log',
+             'actions': [{'type': 'set-flow-log', 'action': 'create',
+                          'create-attrs': [{
+                              'traffic_type': 'all',
+                              'log_group_id': '324d2393-7d89-4262-88b1-c5d3497d5f54',
+                              'log_topic_id': '2fa117ad-3452-4367-b360-88cb89f8a561'}]}]})
+        action = p.resource_manager.actions[0]
+        requests = []
+
+        def create_flow_log(request):
+            requests.append(request)
+            fl = request.body.flow_log.to_dict()
+            fl['id'] = 'fl-%s' % fl['resource_id']
+            return mock.Mock(**{'flow_log.to_dict.return_value': fl})
+
+        client = mock.Mock(create_flow_log=create_flow_log)
+        resources = [{'resource_id': 'vpc-1', 'resource_type': 'vpc'},
+                     {'resource_id': 'vpc-1', 'resource_type': 'vpc'},
+                     {'resource_id': 'vpc-2', 'resource_type': 'vpc'}]
+        # the result is shared by all actions, only look at this run's entries
+        start = len(action.result['succeeded_resources'])
+        with mock.patch.object(
+                p.resource_manager, 'get_client', return_value=client):
+            result = action.process(resources)
+        self.assertEqual(result['action'], 'create')
+        self.assertEqual(sorted(fl['id'] for fl in result['succeeded_resources'][start:]),
+                         ['fl-vpc-1', 'fl-vpc-2'])
+        # the flow log of each resource is created once with its own request
+        self.assertEqual(len({id(r) for r in requests}), 2)
+        for request in requests:
+            fl = request.body.flow_log
+            self.assertEqual(fl.resource_type, 'vpc')
+            self.assertEqual(fl.traffic_type, 'all')
+            self.assertEqual(fl.log_topic_id, '2fa117ad-3452-4367-b360-88cb89f8a561')
+
+    def test_flow_log_create_attrs_validation(self):
+        policy = {
+            'name': 'create-flow-log',
+            'resource': 'huaweicloud.vpc-flow-log',
+            'actions': [{'type': 'set-flow-log', 'action': 'create',
+                         'create-attrs': [{'traffic_type': 'all', 'trafic_type': 'all'}]}]}
+        self.assertRaises(PolicyValidationError, self.load_policy, policy)
+
+    def test_flow_log_create_attrs_resource_keys(self):
+        from c7n_huaweicloud.resources.vpc import SetFlowLog
+        template = SetFlowLog.get_fl_template(
+            'vpc', {'traffic_type': 'all', 'resource_type': 'subnet', 'resource_id': 'x'})
+        self.assertEqual(template.resource_type, 'subnet')
+        self.assertIsNone(template.resource_id)
+        body = SetFlowLog.build_fl_body(template, 'vpc-1')
+        self.assertEqual(body.flow_log.resource_id, 'vpc-1')
+        # unhashable values are not cached but still build a template
+        template = SetFlowLog.get_fl_template('vpc', {'description': ['a']})
+        self.assertEqual(template.description, ['a'])
+
+    def test_flow_log_create_flow_log_retry(self):
+        p = self.load_policy({
+             'name': 'create-flow-log',
+             'resource': 'huaweicloud.vpc-flow-log',
+             'actions': [{'type': 'set-flow-log', 'action': 'create',
+                          'create-attrs': [{'traffic_type': 'all'}]}]})
+        action = p.resource_manager.actions[0]
+        throttled = exceptions.ClientRequestException(429, exceptions.SdkError(
+            request_id='r1', error_code='APIGW.0308', error_msg='too many requests'))
+        calls = []
+
+        def create_flow_log(request):
+            calls.append(request.body.flow_log.resource_id)
+            if len(calls) == 1:
+                raise throttled
+            return mock.Mock(**{'flow_log.to_dict.return_value': {'id': 'fl-1'}})
+
+        client = mock.Mock(create_flow_log=create_flow_log)
+        start = len(action.result['succeeded_resources'])
+        with mock.patch.object(p.resource_manager, 'get_client', return_value=client), \
+                mock.patch('retrying.time.sleep'):
+            result = action.process([{'resource_id': 'vpc-1', 'resource_type': 'vpc'}])
+        # the throttled create is retried like `process_action` does
+        self.assertEqual(calls, ['vpc-1', 'vpc-1'])
+        self.assertEqual(result['succeeded_resources'][start:], [{'id': 'fl-1'}])
+
+    def test_flow_log_result_action_without_resources(self):
+        p = self.load_policy({
+             'name': 'create-flow-log',
+             'resource': 'huaweicloud.vpc-flow-log',
+             'actions': [{'type': 'set-flow-log', 'action': 'create'}]})
+        action = p.resource_manager.actions[0]
+        previous = dict(action.result)
+        action.result['action'] = 'enable'
+        try:
+            start = len(action.result['succeeded_resources'])
+            result = action.process_fl_result([], 'create')
+            self.assertEqual(result['action'], 'create')
+            self.assertEqual(len(result['succeeded_resources']), start)
+        finally:
+            action.result.pop('action')
+            action.result.update(previous)
+
+    def test_flow_log_create_flow_log_partial_failure(self):
+        p = self.load_policy({
+             'name': 'create-flow-log',
+             'resource': 'huaweicloud.vpc-flow-log',
+             'actions': [{'type': 'set-flow-log', 'action': 'create',
+                          'create-attrs': [{'traffic_type': 'all'}]}]})
+        action = p.resource_manager.actions[0]
+        error = exceptions.ClientRequestException(400, exceptions.SdkError(
+            request_id='r1', error_code='VPC.0101', error_msg='invalid resource'))
+        created = []
+
+        def create_flow_log(request):
+            fl = request.body.flow_log
+            if fl.resource_id == 'vpc-2':
+                raise error
+            created.append(fl.resource_id)
+            return mock.Mock(flow_log=fl)
+
+        client = mock.Mock(create_flow_log=create_flow_log)
+        failed = action.failed_resources[:]
+        resources = [{'resource_id': 'vpc-%s' % i, 'resource_type': 'vpc'} for i in range(5)]
+        try:
+            with mock.patch.object(
+                    p.resource_manager, 'get_client', return_value=client):
+                action.process(resources)
+            self.assertEqual(sorted(created), ['vpc-0', 'vpc-1', 'vpc-3', 'vpc-4'])
+            self.assertIn({'resource_id': 'vpc-2', 'resource_type': 'vpc'},
+                          action.failed_resources)
+        finally:
+            action.failed_resources[:] = failed
+
 
 class PortTest(BaseTest):
     def test_port_disable_port_forwarding(self):